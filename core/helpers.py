@@ -1,7 +1,14 @@
+from datetime import timedelta
+import os
+import socket
+import uuid
 from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
 import google.generativeai as genai
 from rest_framework import status
 from rest_framework.response import Response
+from .models import Lead
 
 GEMINI_API_KEY = settings.GEMINI_API_KEY
 
@@ -133,3 +140,94 @@ def get_ai_response(lead):
         return {'Intent': intent_value, 'Reason': reason_value, 'AI_score': score_mapping[intent_value]}
     
     return Response({'error': "API call failed"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+'''
+Returns a lease owner id that is unique to the calling process, e.g. a score_worker or a single scoring request.
+'''
+def new_lease_owner(prefix='worker'):
+    return f'{prefix}:{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+'''
+Returns the leads that still need scoring and are not held by a live lease. Leads whose lease has expired (e.g. the worker crashed) are included again, while leads that already failed SCORE_MAX_ATTEMPTS times are left out.
+'''
+def get_unleased_leads(now=None):
+    now = now or timezone.now()
+    return Lead.objects.filter(score__isnull=True, intent_label__isnull=True, reasoning__isnull=True).filter(
+        Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now)).filter(
+        score_attempts__lt=settings.SCORE_MAX_ATTEMPTS)
+
+'''
+Claims up to batch_size unscored leads for the given owner by writing the lease owner and expiry on the rows. The UPDATE only matches rows that are still unleased, so when two owners race for the same leads each row ends up with exactly one owner. If another owner took the whole batch, the next candidates are tried. Returns the leads this owner now holds, or an empty list when nothing is left to claim.
+'''
+def claim_leads(owner, batch_size, lease_seconds, offer_id=None):
+    while True:
+        now = timezone.now()
+        candidates = get_unleased_leads(now)
+        if offer_id is not None:
+            candidates = candidates.filter(offer_id=offer_id)
+        lead_ids = list(candidates.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not lead_ids:
+            return []
+
+        get_unleased_leads(now).filter(id__in=lead_ids).update(
+            lease_owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds))
+        claimed_leads = list(Lead.objects.filter(id__in=lead_ids, lease_owner=owner).select_related('offer'))
+        if claimed_leads:
+            return claimed_leads
+
+'''
+Pushes the lease expiry of a single lead forward, as long as the owner still holds it. Returns False if the lease was taken over by someone else.
+'''
+def renew_lease(lead, owner, lease_seconds):
+    return Lead.objects.filter(id=lead.id, lease_owner=owner).update(
+        lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds)) == 1
+
+'''
+Drops every lease still held by the owner, so the leads can be claimed again right away.
+'''
+def release_leases(owner):
+    return Lead.objects.filter(lease_owner=owner).update(lease_owner=None, lease_expires_at=None)
+
+'''
+Scores a leased lead and saves the result, releasing the lease in the same query. The lease is renewed before the AI call, so a slow batch does not expire under the owner, and a lead whose lease was already taken over is skipped without calling the AI. The save only goes through while the owner still holds the lease, so a lead is never written twice.
+Returns True if the score was saved and False if the lease was lost. Scoring errors are raised to the caller, which should record them with record_scoring_failure.
+'''
+def score_leased_lead(lead, owner, lease_seconds):
+    if not renew_lease(lead, owner, lease_seconds):
+        return False
+
+    rule_layer_points = get_rule_points(lead)
+    ai_layer_response = get_ai_response(lead)
+    if not isinstance(ai_layer_response, dict):
+        raise ValueError('AI call failed')
+
+    updated = Lead.objects.filter(id=lead.id, lease_owner=owner).update(
+        score=rule_layer_points + ai_layer_response['AI_score'],
+        intent_label=ai_layer_response['Intent'],
+        reasoning=ai_layer_response['Reason'],
+        lease_owner=None,
+        lease_expires_at=None,
+    )
+    return updated == 1
+
+'''
+Records a failed scoring attempt on a leased lead and releases it with a backoff: the lease expiry is pushed lease_seconds times the number of attempts into the future, so a short AI outage does not burn through every attempt at once. Once a lead has failed SCORE_MAX_ATTEMPTS times it is no longer claimed, and scoring_error keeps the last error.
+'''
+def record_scoring_failure(lead, owner, error, lease_seconds):
+    attempts = lead.score_attempts + 1
+    return Lead.objects.filter(id=lead.id, lease_owner=owner).update(
+        score_attempts=F('score_attempts') + 1,
+        scoring_error=f'{type(error).__name__}: {error}',
+        lease_owner=None,
+        lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds * attempts),
+    ) == 1
+
+'''
+Clears the failed attempts of unscored leads that reached SCORE_MAX_ATTEMPTS, so they are claimed again. Returns the number of leads reset.
+'''
+def reset_failed_leads(offer_id=None):
+    failed_leads = Lead.objects.filter(score__isnull=True, score_attempts__gte=settings.SCORE_MAX_ATTEMPTS)
+    if offer_id is not None:
+        failed_leads = failed_leads.filter(offer_id=offer_id)
+    return failed_leads.update(score_attempts=0, scoring_error=None, lease_owner=None, lease_expires_at=None)
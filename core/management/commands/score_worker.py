@@ -0,0 +1,156 @@
+import logging
+import multiprocessing
+import queue
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+
+from core.helpers import claim_leads, new_lease_owner, record_scoring_failure, release_leases, reset_failed_leads, score_leased_lead
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Scores pending leads outside of the web request. Each worker claims a batch of leads through a lease stored on the rows (lease_owner and lease_expires_at), scores them and releases the lease when the score is saved.
+Any number of workers can run at the same time, on one host or many, without scoring a lead twice. The lease of each lead is renewed right before it is scored. If a worker crashes its leases expire after --lease-seconds and the leads are claimed again by the other workers.
+'''
+class Command(BaseCommand):
+    help = 'Claims batches of unscored leads through a lease and scores them. Use --processes to start several local workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Number of local worker processes to fork.')
+        parser.add_argument('--batch-size', type=int, default=10, help='Number of leads claimed per lease.')
+        parser.add_argument('--lease-seconds', type=int, default=settings.SCORE_LEASE_SECONDS, help='How long a claimed batch is held before other workers may reclaim it.')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to wait before polling again when no leads are pending.')
+        parser.add_argument('--offer', type=int, default=None, help='Only score leads of this offer.')
+        parser.add_argument('--exit-when-empty', action='store_true', help='Stop once there are no leads left to claim instead of polling.')
+        parser.add_argument('--retry-failed', action='store_true', help='Reset the attempts of leads that failed SCORE_MAX_ATTEMPTS times, so they are scored again.')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1 or options['batch_size'] < 1 or options['lease_seconds'] < 1:
+            raise CommandError('--processes, --batch-size and --lease-seconds must be at least 1')
+
+        if options['retry_failed']:
+            self.stdout.write(f"Reset {reset_failed_leads(options['offer'])} failed leads for retry")
+
+        if options['processes'] == 1:
+            reports = [run_worker(options)]
+        else:
+            reports = self.run_processes(options)
+
+        for report in reports:
+            self.stdout.write(format_report(report))
+        if len(reports) > 1:
+            total = {
+                'owner': 'total',
+                'scored': sum(report['scored'] for report in reports),
+                'failed': sum(report['failed'] for report in reports),
+                'skipped': sum(report['skipped'] for report in reports),
+                'seconds': max(report['seconds'] for report in reports),
+            }
+            self.stdout.write(self.style.SUCCESS(format_report(total)))
+
+    def run_processes(self, options):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('--processes needs the fork start method, which is not available on this platform. Start one worker per process instead.')
+
+        # Forked children must not share the parent's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [context.Process(target=worker_process, args=(options, results)) for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+
+        reports = []
+        while len(reports) < len(processes):
+            try:
+                reports.append(results.get(timeout=1))
+            except KeyboardInterrupt:
+                # The workers get the same interrupt and send their reports before exiting.
+                continue
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                self.stderr.write(f'Worker process {process.pid} exited with code {process.exitcode}')
+        return reports
+
+
+def worker_process(options, results):
+    results.put(run_worker(options))
+
+
+'''
+Claims and scores leads until interrupted, or until nothing is left to claim when --exit-when-empty is set. A lead that fails to score is logged and its attempt is recorded; it is released with a backoff and retried until it reaches SCORE_MAX_ATTEMPTS. Database errors, such as a locked SQLite database, are logged and the worker keeps polling without counting them against the lead. Leads whose lease was taken over by another worker are skipped. Returns the worker's throughput report.
+'''
+def run_worker(options):
+    owner = new_lease_owner()
+    scored, failed, skipped = 0, 0, 0
+    started_at = time.perf_counter()
+    try:
+        while True:
+            try:
+                leads = claim_leads(owner, options['batch_size'], options['lease_seconds'], options['offer'])
+            except DatabaseError:
+                logger.exception('Claiming leads failed, retrying in %s seconds', options['poll_interval'])
+                close_unusable_connections()
+                time.sleep(options['poll_interval'])
+                continue
+
+            if not leads:
+                if options['exit_when_empty']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            for lead in leads:
+                try:
+                    saved = score_leased_lead(lead, owner, options['lease_seconds'])
+                except DatabaseError:
+                    # The lead keeps its lease and is picked up again once it is released or expires.
+                    logger.exception('Database error while scoring lead %s', lead.id)
+                    close_unusable_connections()
+                    skipped += 1
+                    continue
+                except Exception as e:
+                    logger.exception('Scoring failed for lead %s', lead.id)
+                    try:
+                        record_scoring_failure(lead, owner, e, options['lease_seconds'])
+                    except DatabaseError:
+                        logger.exception('Could not record the scoring failure of lead %s', lead.id)
+                    failed += 1
+                    continue
+                if saved:
+                    scored += 1
+                else:
+                    skipped += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            release_leases(owner)
+        except DatabaseError:
+            logger.exception('Releasing the leases of %s failed, they will expire on their own', owner)
+        connections.close_all()
+
+    return {'owner': owner, 'scored': scored, 'failed': failed, 'skipped': skipped, 'seconds': time.perf_counter() - started_at}
+
+
+'''
+Drops connections that a database error left broken, so the next query opens a fresh one. Connections inside a transaction are left alone.
+'''
+def close_unusable_connections():
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+def format_report(report):
+    rate = report['scored'] / report['seconds'] if report['seconds'] else 0
+    return f"{report['owner']}: scored {report['scored']} leads, {report['failed']} failed, {report['skipped']} skipped in {report['seconds']:.1f}s ({rate:.2f} leads/s)"
@@ -0,0 +1,97 @@
+import cProfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .models import RequestProfile
+
+
+'''
+Wraps every SQL query executed during a profiled request, to count them and add up the time they took.
+'''
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started_at
+
+
+'''
+Opt-in per request profiling. It is only installed when PROFILING_ENABLED is set, otherwise Django drops it at startup and it costs nothing.
+A request is profiled when it carries the X-Profile header or the ?profile query parameter set to a true value (1, true, yes or on) and comes from a logged in staff user. The cProfile stats are dumped as a .prof (pstats) file into PROFILING_DIR and a RequestProfile record is saved with the SQL query count and duration. Only the newest PROFILING_MAX_PROFILES profiles are kept.
+Only one cProfile profiler can be active per process, so while one request is being profiled, other profiling requests are served without profiling. Streaming responses do their work after the view returns, so their profiles only cover the setup of the response.
+'''
+class ProfilingMiddleware:
+    header = 'HTTP_X_PROFILE'
+    query_param = 'profile'
+    truthy_values = {'1', 'true', 'yes', 'on'}
+    profiler_lock = threading.Lock()
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.profiling_dir = settings.PROFILING_DIR
+        self.max_profiles = settings.PROFILING_MAX_PROFILES
+
+    def __call__(self, request):
+        trigger = request.META.get(self.header) or request.GET.get(self.query_param) or ''
+        if trigger.lower() not in self.truthy_values:
+            return self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        if not (user and user.is_staff) or not self.profiler_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+            recorder = QueryRecorder()
+            started_at = time.perf_counter()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+            duration = time.perf_counter() - started_at
+        finally:
+            self.profiler_lock.release()
+
+        self.profiling_dir.mkdir(parents=True, exist_ok=True)
+        stats_file = f'{uuid.uuid4().hex}.prof'
+        profiler.dump_stats(self.profiling_dir / stats_file)
+
+        RequestProfile.objects.create(
+            method=request.method,
+            path=request.path[:255],
+            status_code=response.status_code,
+            duration_ms=round(duration * 1000, 2),
+            query_count=recorder.count,
+            query_duration_ms=round(recorder.duration * 1000, 2),
+            stats_file=stats_file,
+        )
+        self.prune_profiles()
+        return response
+
+    '''
+    Deletes the profiles, and their stats files, that fall outside the newest PROFILING_MAX_PROFILES.
+    '''
+    def prune_profiles(self):
+        old_profiles = list(RequestProfile.objects.order_by('-created_at', '-id')[self.max_profiles:])
+        for profile in old_profiles:
+            (self.profiling_dir / profile.stats_file).unlink(missing_ok=True)
+        RequestProfile.objects.filter(id__in=[profile.id for profile in old_profiles]).delete()
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lead',
+            name='company',
+            field=models.CharField(blank=True, default='', max_length=150, null=True),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='industry',
+            field=models.CharField(blank=True, default='', max_length=180, null=True),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='linkedin_bio',
+            field=models.CharField(blank=True, default='', max_length=360, null=True),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='location',
+            field=models.CharField(blank=True, default='', max_length=180, null=True),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='role',
+            field=models.CharField(blank=True, default='', max_length=150, null=True),
+        ),
+        migrations.CreateModel(
+            name='UploadReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(blank=True, default='', max_length=255)),
+                ('fieldnames', models.JSONField(default=list)),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='core.offer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_number', models.PositiveIntegerField()),
+                ('row', models.JSONField()),
+                ('errors', models.JSONField()),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='core.uploadreport')),
+            ],
+            options={
+                'ordering': ['row_number'],
+            },
+        ),
+    ]
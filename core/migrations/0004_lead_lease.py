@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_request_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_lead_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='score_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='scoring_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_lead_scoring_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='upload',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leads', to='core.uploadreport'),
+        ),
+    ]
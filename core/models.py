@@ -28,6 +28,52 @@ class Lead(models.Model):
     score = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(100)], null=True, blank=True)
     intent_label = models.CharField(choices=intent_choices, max_length=10, null=True)
     reasoning = models.TextField(null=True, blank=True)
+    # Set while a score_worker process holds the lead, so other workers skip it until the lease expires.
+    lease_owner = models.CharField(max_length=100, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    upload = models.ForeignKey('UploadReport', on_delete=models.SET_NULL, null=True, blank=True, related_name='leads')
+    score_attempts = models.PositiveSmallIntegerField(default=0)
+    scoring_error = models.TextField(null=True, blank=True)
 
     def __str__(self):
-        return f'{self.name} - {self.role} - {self.company}'
\ No newline at end of file
+        return f'{self.name} - {self.role} - {self.company}'
+
+class UploadReport(models.Model):
+    offer = models.ForeignKey(Offer, on_delete=models.CASCADE, related_name='uploads')
+    file_name = models.CharField(max_length=255, blank=True, default="")
+    fieldnames = models.JSONField(default=list)
+    created_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    duration_ms = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Upload {self.id} - {self.file_name}'
+
+class UploadError(models.Model):
+    report = models.ForeignKey(UploadReport, on_delete=models.CASCADE, related_name='errors')
+    row_number = models.PositiveIntegerField()
+    row = models.JSONField()
+    errors = models.JSONField()
+
+    class Meta:
+        ordering = ['row_number']
+
+    def __str__(self):
+        return f'Upload {self.report_id} - row {self.row_number}'
+
+class RequestProfile(models.Model):
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    query_duration_ms = models.FloatField()
+    stats_file = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.method} {self.path} - {self.duration_ms}ms'
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Offer, Lead
+from .models import Offer, Lead, UploadReport, UploadError, RequestProfile
 
 class OfferSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,11 +19,25 @@ class LeadSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Lead
-        fields = '__all__'
+        exclude = ['upload', 'lease_owner', 'lease_expires_at', 'score_attempts', 'scoring_error']
 
 class LeadResultsSerializer(serializers.ModelSerializer):
     offer_name = serializers.StringRelatedField(source='offer')
     class Meta:
         model = Lead
         fields = ['id', 'offer_name', 'name', 'role', 'company', 'industry', 'location', 'intent_label', 'score', 'reasoning']
-        
\ No newline at end of file
+
+class UploadReportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadReport
+        fields = ['id', 'offer', 'file_name', 'created_count', 'failed_count', 'duration_ms', 'created_at']
+
+class UploadErrorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadError
+        fields = ['row_number', 'row', 'errors']
+
+class RequestProfileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RequestProfile
+        fields = ['id', 'method', 'path', 'status_code', 'duration_ms', 'query_count', 'query_duration_ms', 'created_at']
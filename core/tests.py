@@ -1,3 +1,321 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import Offer, Lead, RequestProfile, UploadReport
+from . import views
+from . import helpers
+from .helpers import claim_leads, record_scoring_failure, score_leased_lead
+
+
+def make_offer():
+    return Offer.objects.create(name='Cloud Analytics', value_props=['Real-time insights'], ideal_use_cases=['Fintech startups'])
+
+
+class UploadLeadsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.offer = make_offer()
+
+    def upload(self, content, mode=None):
+        url = f'/api/leads/upload/{self.offer.id}/'
+        if mode:
+            url += f'?mode={mode}'
+        file = SimpleUploadedFile('leads.csv', content)
+        return self.client.post(url, {'file': file}, format='multipart')
+
+    def test_summary_mode_returns_only_counts(self):
+        response = self.upload(b'name,role,company\nAva,CEO,Acme\n,CTO,"Beta, Inc"\nBen,Manager,Gamma\n', mode='summary')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'upload_id', 'message', 'failed', 'created_count', 'failed_count', 'duration_ms'})
+        self.assertEqual(response.data['created_count'], 2)
+        self.assertEqual(response.data['failed_count'], 1)
+        self.assertEqual(Lead.objects.filter(upload_id=response.data['upload_id']).count(), 2)
+        report = UploadReport.objects.get(id=response.data['upload_id'])
+        self.assertEqual((report.created_count, report.failed_count), (2, 1))
+
+    def test_full_mode_echoes_rows(self):
+        response = self.upload(b'name,role\nAva,CEO\n,CTO\n')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'upload_id', 'message', 'failed', 'created_leads', 'failed_leads'})
+        self.assertEqual([lead['name'] for lead in response.data['created_leads']], ['Ava'])
+        self.assertEqual(response.data['failed_leads'][0]['row'], {'name': '', 'role': 'CTO'})
+
+    def test_upload_errors_are_paginated(self):
+        rows = ''.join(f',Role {i}\n' for i in range(5))
+        upload_id = self.upload(f'name,role\n{rows}'.encode(), mode='summary').data['upload_id']
+
+        response = self.client.get(f'/api/uploads/{upload_id}/errors/?page=2&page_size=2')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([error['row_number'] for error in response.data['results']], [3, 4])
+        self.assertIn('name', response.data['results'][0]['errors'])
+
+    def test_upload_errors_export_csv(self):
+        upload_id = self.upload(b'name,role,company\nAva,CEO,Acme\n,CTO,"Beta, Inc"\n', mode='summary').data['upload_id']
+
+        response = self.client.get(f'/api/uploads/{upload_id}/errors/export/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'row_number,name,role,company,errors')
+        self.assertTrue(lines[1].startswith('2,,CTO,"Beta, Inc",'))
+        self.assertEqual(len(lines), 2)
+
+    def test_invalid_utf8_after_a_saved_batch_removes_the_upload(self):
+        valid_rows = ''.join(f'Lead {i},CEO\n' for i in range(views.UPLOAD_BATCH_SIZE + 1))
+        content = f'name,role\n{valid_rows}'.encode() + b'Bad \xff\xfe,CEO\n'
+
+        response = self.upload(content, mode='summary')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Lead.objects.count(), 0)
+        self.assertEqual(UploadReport.objects.count(), 0)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.profiling_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.profiling_dir, ignore_errors=True)
+        settings_override = override_settings(PROFILING_ENABLED=True, PROFILING_DIR=self.profiling_dir, PROFILING_MAX_PROFILES=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        make_offer()
+
+    def test_anonymous_requests_are_not_profiled(self):
+        response = self.client.get('/api/view_offers/?profile=1', HTTP_X_PROFILE='1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(RequestProfile.objects.count(), 0)
+        self.assertEqual(list(self.profiling_dir.iterdir()), [])
+
+    def test_staff_requests_are_profiled_and_pruned(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        self.client.get('/api/view_offers/')
+        self.assertEqual(RequestProfile.objects.count(), 0)
+
+        for _ in range(3):
+            self.client.get('/api/view_offers/', HTTP_X_PROFILE='1')
+
+        profiles = RequestProfile.objects.all()
+        self.assertEqual(profiles.count(), 2)
+        self.assertEqual({path.name for path in self.profiling_dir.iterdir()}, {profile.stats_file for profile in profiles})
+        self.assertGreaterEqual(profiles[0].query_count, 1)
+
+        response = self.client.get(f'/api/profiles/{profiles[0].id}/download/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_false_trigger_values_are_not_profiled(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        self.client.get('/api/view_offers/', HTTP_X_PROFILE='0')
+        self.client.get('/api/view_offers/?profile=false')
+
+        self.assertEqual(RequestProfile.objects.count(), 0)
+
+    def test_profile_listing_is_admin_only(self):
+        User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.login(username='user', password='password')
+
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 403)
+
+    def test_profile_listing(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.client.get('/api/view_offers/?profile=1')
+
+        response = self.client.get('/api/profiles/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['method'], 'GET')
+        self.assertEqual(response.data[0]['path'], '/api/view_offers/')
+        self.assertEqual(response.data[0]['status_code'], 200)
+        self.assertNotIn('stats_file', response.data[0])
+
+
+def fake_ai_response(lead):
+    return {'Intent': 'High', 'Reason': 'Decision maker in a target industry.', 'AI_score': 50}
+
+
+@override_settings(SCORE_MAX_ATTEMPTS=2)
+class LeaseScoringTests(TestCase):
+    def setUp(self):
+        self.offer = make_offer()
+        self.leads = Lead.objects.bulk_create([Lead(offer=self.offer, name=f'Lead {i}', role='CEO') for i in range(6)])
+
+    def test_two_owners_claim_disjoint_leads(self):
+        first = claim_leads('worker-a', 4, 60)
+        second = claim_leads('worker-b', 4, 60)
+
+        self.assertEqual(len(first), 4)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({lead.id for lead in first} & {lead.id for lead in second})
+        self.assertEqual(claim_leads('worker-c', 4, 60), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        claim_leads('crashed-worker', 6, 60)
+        Lead.objects.filter(id=self.leads[0].id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        reclaimed = claim_leads('worker-b', 6, 60)
+
+        self.assertEqual([lead.id for lead in reclaimed], [self.leads[0].id])
+
+    @mock.patch('core.helpers.get_ai_response', side_effect=fake_ai_response)
+    def test_score_is_not_saved_after_lease_takeover(self, ai_response):
+        lead = claim_leads('worker-a', 1, 60)[0]
+        Lead.objects.filter(id=lead.id).update(lease_owner='worker-b')
+
+        self.assertFalse(score_leased_lead(lead, 'worker-a', 60))
+        ai_response.assert_not_called()
+        lead.refresh_from_db()
+        self.assertIsNone(lead.score)
+        self.assertEqual(lead.lease_owner, 'worker-b')
+
+    @mock.patch('core.helpers.get_ai_response', side_effect=fake_ai_response)
+    def test_score_endpoint_skips_leased_leads(self, ai_response):
+        leased = claim_leads('worker-a', 2, 60)
+
+        response = APIClient().post(f'/api/score/{self.offer.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ai_response.call_count, 4)
+        self.assertNotIn(leased[0], [call.args[0] for call in ai_response.call_args_list])
+        self.assertEqual(Lead.objects.filter(score__isnull=True).count(), 2)
+        self.assertEqual(Lead.objects.filter(lease_owner='worker-a').count(), 2)
+
+    def test_score_endpoint_and_worker_never_score_the_same_lead(self):
+        scored_ids, worker_claims = [], []
+
+        def ai_response(lead):
+            scored_ids.append(lead.id)
+            worker_claims.extend(claim_leads('worker-a', 6, 60))
+            return fake_ai_response(lead)
+
+        with mock.patch('core.helpers.get_ai_response', side_effect=ai_response):
+            APIClient().post(f'/api/score/{self.offer.id}/')
+
+        self.assertEqual(sorted(scored_ids), [lead.id for lead in self.leads])
+        self.assertEqual(worker_claims, [])
+
+    def test_failures_are_recorded_with_backoff_until_max_attempts(self):
+        for attempt in range(1, 3):
+            lead = claim_leads('worker-a', 1, 60)[0]
+            self.assertEqual(lead.id, self.leads[0].id)
+            record_scoring_failure(lead, 'worker-a', ValueError('Unparseable AI reply'), 60)
+
+            lead.refresh_from_db()
+            self.assertIsNone(lead.lease_owner)
+            self.assertGreater(lead.lease_expires_at, timezone.now() + timedelta(seconds=60 * attempt - 5))
+            self.assertNotIn(lead.id, [claimed.id for claimed in claim_leads('worker-b', 6, 60)])
+            Lead.objects.update(lease_owner=None, lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        lead.refresh_from_db()
+        self.assertEqual(lead.score_attempts, 2)
+        self.assertEqual(lead.scoring_error, 'ValueError: Unparseable AI reply')
+        self.assertNotIn(lead.id, [claimed.id for claimed in claim_leads('worker-a', 6, 60)])
+
+    def test_retry_failed_resets_exhausted_leads(self):
+        Lead.objects.filter(id=self.leads[0].id).update(score_attempts=2, scoring_error='ValueError: Unparseable AI reply')
+
+        stdout = StringIO()
+        with mock.patch('core.helpers.get_ai_response', side_effect=fake_ai_response):
+            call_command('score_worker', retry_failed=True, exit_when_empty=True, stdout=stdout)
+
+        self.assertIn('Reset 1 failed leads', stdout.getvalue())
+        lead = Lead.objects.get(id=self.leads[0].id)
+        self.assertEqual(lead.score, 70)
+        self.assertEqual(lead.score_attempts, 0)
+        self.assertIsNone(lead.scoring_error)
+
+    def test_score_worker_logs_failures_and_scores_the_rest(self):
+        def ai_response(lead):
+            if lead.id == self.leads[0].id:
+                raise ValueError('Unparseable AI reply')
+            return fake_ai_response(lead)
+
+        stdout = StringIO()
+        with mock.patch('core.helpers.get_ai_response', side_effect=ai_response), self.assertLogs('core.management.commands.score_worker', 'ERROR'):
+            call_command('score_worker', exit_when_empty=True, batch_size=4, stdout=stdout)
+
+        self.assertIn('scored 5 leads, 1 failed', stdout.getvalue())
+        self.assertEqual(Lead.objects.filter(score__isnull=False).count(), 5)
+        failed_lead = Lead.objects.get(id=self.leads[0].id)
+        self.assertEqual(failed_lead.score_attempts, 1)
+        self.assertGreater(failed_lead.lease_expires_at, timezone.now())
+        self.assertFalse(Lead.objects.exclude(lease_owner=None).exists())
+
+    @mock.patch('core.helpers.get_ai_response', side_effect=fake_ai_response)
+    def test_score_worker_survives_database_errors(self, ai_response):
+        real_claim_leads, real_renew_lease = claim_leads, helpers.renew_lease
+        claim_errors, renew_errors = [OperationalError('database is locked')], [OperationalError('database is locked')]
+
+        def flaky_claim_leads(*args, **kwargs):
+            if claim_errors:
+                raise claim_errors.pop()
+            return real_claim_leads(*args, **kwargs)
+
+        def flaky_renew_lease(*args, **kwargs):
+            if renew_errors:
+                raise renew_errors.pop()
+            return real_renew_lease(*args, **kwargs)
+
+        stdout = StringIO()
+        with mock.patch('core.management.commands.score_worker.claim_leads', side_effect=flaky_claim_leads), \
+                mock.patch('core.helpers.renew_lease', side_effect=flaky_renew_lease), \
+                self.assertLogs('core.management.commands.score_worker', 'ERROR') as logs:
+            call_command('score_worker', exit_when_empty=True, poll_interval=0, stdout=stdout)
+
+        self.assertIn('Claiming leads failed', logs.output[0])
+        # The lead hit by the database error is skipped, not counted as a failed attempt, and released at the end.
+        self.assertIn('scored 5 leads, 0 failed, 1 skipped', stdout.getvalue())
+        self.assertFalse(Lead.objects.exclude(score_attempts=0).exists())
+        self.assertFalse(Lead.objects.exclude(lease_owner=None).exists())
+
+    def test_score_endpoint_reports_why_nothing_is_left(self):
+        client = APIClient()
+        Lead.objects.filter(id__in=[lead.id for lead in self.leads[:3]]).update(score_attempts=2)
+        Lead.objects.filter(id__in=[lead.id for lead in self.leads[3:]]).update(
+            lease_owner='worker-a', lease_expires_at=timezone.now() + timedelta(seconds=60))
+
+        response = client.post(f'/api/score/{self.offer.id}/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual((response.data['held'], response.data['failed']), (3, 3))
+        self.assertIn('--retry-failed', response.data['message'])
+
+        Lead.objects.filter(lease_owner='worker-a').update(score=50, intent_label='high', reasoning='r')
+        response = client.post(f'/api/score/{self.offer.id}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['failed'], 3)
+
+        Lead.objects.update(score=50, intent_label='high', reasoning='r')
+        response = client.post(f'/api/score/{self.offer.id}/')
+        self.assertEqual(response.data, {'message': 'No leads left to score on this offer'})
+
+    @mock.patch('core.helpers.get_ai_response', side_effect=ValueError('Unparseable AI reply'))
+    def test_score_endpoint_records_failure_and_releases_leases(self, ai_response):
+        with self.assertLogs('core.views', 'ERROR'):
+            response = APIClient().post(f'/api/score/{self.offer.id}/')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(Lead.objects.get(id=self.leads[0].id).score_attempts, 1)
+        self.assertFalse(Lead.objects.exclude(lease_owner=None).exists())
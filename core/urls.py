@@ -1,5 +1,5 @@
 from django.urls import include, path
-from .views import export_result, offer, upload_leads, get_leads_score, result, view_leads, view_offers
+from .views import download_profile, export_result, export_upload_errors, offer, upload_errors, upload_leads, upload_report, get_leads_score, result, view_leads, view_offers, view_profiles
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -7,10 +7,15 @@ router = DefaultRouter()
 urlpatterns = [
     path('offer/', offer, name='offer'),
     path('leads/upload/<int:offer_id>/', upload_leads, name='upload_leads'),
+    path('uploads/<int:upload_id>/', upload_report, name='upload_report'),
+    path('uploads/<int:upload_id>/errors/', upload_errors, name='upload_errors'),
+    path('uploads/<int:upload_id>/errors/export/', export_upload_errors, name='export_upload_errors'),
     path('score/<int:offer_id>/', get_leads_score, name='get_leads_score'),
     path('result/', result, name='result'),
     path('view_leads/', view_leads, name='view_leads'),
     path('view_offers/', view_offers, name='view_offers'),
     path('export/', export_result, name='export_result'),
+    path('profiles/', view_profiles, name='view_profiles'),
+    path('profiles/<int:profile_id>/download/', download_profile, name='download_profile'),
 ]
 
@@ -1,19 +1,30 @@
-from .serializers import LeadResultsSerializer, LeadSerializer, OfferSerializer
-from .models import Offer, Lead
-from rest_framework.decorators import api_view
+from .serializers import LeadResultsSerializer, LeadSerializer, OfferSerializer, RequestProfileSerializer, UploadErrorSerializer, UploadReportSerializer
+from .models import Offer, Lead, RequestProfile, UploadReport, UploadError
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework import status, serializers
+import codecs
 import csv
+import json
+import logging
+import time
 import requests
-from io import StringIO
+from django.db import DatabaseError, transaction
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiResponse
-from django.http import HttpResponse
-from .helpers import get_rule_points, get_ai_response
+from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiResponse, PolymorphicProxySerializer
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from .helpers import claim_leads, get_unleased_leads, new_lease_owner, record_scoring_failure, release_leases, score_leased_lead
 # Create your views here.
 
 
 BASE_URL = 'https://lead-scoring-system-4eiv.onrender.com/api'
+SCORE_BATCH_SIZE = 10
+
+logger = logging.getLogger(__name__)
 
 
 '''
@@ -38,22 +49,35 @@ def offer(request):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+UPLOAD_BATCH_SIZE = 500
+
 class UploadLeadsSuccessResponseSerializer(serializers.Serializer):
+    upload_id = serializers.IntegerField()
     message = serializers.CharField()
     failed = serializers.CharField()
     created_leads = LeadSerializer(many=True)
     failed_leads = serializers.ListField(child=serializers.DictField())
 
+class UploadLeadsSummaryResponseSerializer(serializers.Serializer):
+    upload_id = serializers.IntegerField()
+    message = serializers.CharField()
+    failed = serializers.CharField()
+    created_count = serializers.IntegerField()
+    failed_count = serializers.IntegerField()
+    duration_ms = serializers.IntegerField()
+
 
 '''
 Endpoint to upload leads for a specific offer. It accepts an integer -> offer_id, through which it recognizes the offer to which the leads are uploaded to.
+The CSV is read row by row and leads are saved in batches. Every upload gets an UploadReport, and the failed rows are stored as UploadError records so they can be fetched later. With ?mode=summary only the counts, timing and upload_id are returned, so the response size stays the same no matter how big the file is.
 '''
 
 @extend_schema(
     summary="Upload Leads via CSV",
-    description="Uploads a CSV file of leads to associate with a specific offer.",
+    description="Uploads a CSV file of leads to associate with a specific offer. Pass mode=summary to get only the counts, timing and upload_id back instead of every created and failed row.",
     parameters=[
         OpenApiParameter(name='offer_id', description='ID of the offer to associate leads with', required=True, type=int, location=OpenApiParameter.PATH),
+        OpenApiParameter(name='mode', description='Response mode: "full" (default) or "summary"', required=False, type=str, enum=['full', 'summary']),
     ],
     request={
         'multipart/form-data': {
@@ -68,7 +92,11 @@ Endpoint to upload leads for a specific offer. It accepts an integer -> offer_id
         }
     },
     responses={
-        200: UploadLeadsSuccessResponseSerializer,
+        200: PolymorphicProxySerializer(
+            component_name='UploadLeadsResponse',
+            serializers=[UploadLeadsSuccessResponseSerializer, UploadLeadsSummaryResponseSerializer],
+            resource_type_field_name=None,
+        ),
         400: OpenApiResponse(description="Bad Request - The uploaded file is not a valid CSV."),
         404: OpenApiResponse(description="Not Found - The specified offer_id does not exist."),
     },
@@ -86,29 +114,161 @@ def upload_leads(request, offer_id):
     
     if not file.name.endswith('.csv'):
         return Response({'error': 'Only CSV files are  supported'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    decoded_file = file.read().decode('utf-8')
-    io_string = StringIO(decoded_file)
-    reader = csv.DictReader(io_string)
 
-    created_leads, failed_leads = [], []
-    for row in reader:
-        row_data = {**row, "offer": offer.id}
+    summary_mode = request.query_params.get('mode') == 'summary'
+    started_at = time.perf_counter()
+
+    # The file is decoded line by line instead of being read into memory as a whole. Every batch is committed on its own,
+    # so a large upload does not hold the database write lock while the rest of the file is parsed.
+    reader = csv.DictReader(codecs.iterdecode(file, 'utf-8'))
+    report = None
+    try:
+        report = UploadReport.objects.create(offer=offer, file_name=file.name, fieldnames=reader.fieldnames or [])
+
+        created_leads, failed_leads = [], []
+        pending_leads, pending_errors = [], []
+        for row_number, row in enumerate(reader, start=1):
+            row_data = {**row, "offer": offer.id}
+
+            serializer = LeadSerializer(data=row_data)
+            if serializer.is_valid():
+                pending_leads.append(Lead(**serializer.validated_data, upload=report))
+            else:
+                # if only "name" is missing, fail; otherwise model handles defaults
+                pending_errors.append(UploadError(report=report, row_number=row_number, row=row, errors=serializer.errors))
+                if not summary_mode:
+                    failed_leads.append({"row": row, "errors": serializer.errors})
+
+            if len(pending_leads) >= UPLOAD_BATCH_SIZE or len(pending_errors) >= UPLOAD_BATCH_SIZE:
+                save_upload_batch(report, pending_leads, pending_errors, None if summary_mode else created_leads)
+                pending_leads, pending_errors = [], []
+
+        report.duration_ms = int((time.perf_counter() - started_at) * 1000)
+        save_upload_batch(report, pending_leads, pending_errors, None if summary_mode else created_leads)
+    except (UnicodeDecodeError, csv.Error) as e:
+        # The batches saved before the broken line are already committed, so they are removed along with the report.
+        if report is not None:
+            Lead.objects.filter(upload=report).delete()
+            report.delete()
+        return Response({'error': f'The uploaded file is not a valid UTF-8 CSV: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    response_data = {
+        'upload_id': report.id,
+        'message': f'{report.created_count} leads uploaded successfully to offer: {offer_id}',
+        'failed': f'Failed to upload {report.failed_count} leads',
+    }
+    if summary_mode:
+        response_data.update({
+            'created_count': report.created_count,
+            'failed_count': report.failed_count,
+            'duration_ms': report.duration_ms})
+    else:
+        response_data.update({
+            'created_leads': created_leads,
+            'failed_leads': failed_leads})
+    return Response(response_data)
+
+'''
+Helper to save a batch of validated leads and failed rows of an upload, and the running counts of the report, in one transaction. When created_leads is given, the saved leads are serialized into it for the full upload response.
+'''
+def save_upload_batch(report, leads, errors, created_leads=None):
+    with transaction.atomic():
+        Lead.objects.bulk_create(leads)
+        UploadError.objects.bulk_create(errors)
+        report.created_count += len(leads)
+        report.failed_count += len(errors)
+        report.save(update_fields=['created_count', 'failed_count', 'duration_ms'])
+    if created_leads is not None:
+        created_leads.extend(LeadSerializer(leads, many=True).data)
+
+
+class UploadErrorPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+@extend_schema(
+    summary="View Upload Report",
+    description="Retrieves the counts and timing of a previous lead upload.",
+    parameters=[
+        OpenApiParameter(name='upload_id', description='ID of the upload returned by the upload endpoint', required=True, type=int, location=OpenApiParameter.PATH),
+    ],
+    responses={
+        200: UploadReportSerializer,
+        404: OpenApiResponse(description="Not Found - The specified upload_id does not exist."),
+    },
+    tags=['Leads']
+)
+@api_view(['GET'])
+def upload_report(request, upload_id):
+    report = get_object_or_404(UploadReport, id=upload_id)
+    serializer = UploadReportSerializer(report)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+'''
+Endpoint to fetch the failed rows of an upload in pages. Use ?page= and ?page_size= to move through the report.
+'''
+@extend_schema(
+    summary="View Upload Errors",
+    description="Retrieves the failed rows of a lead upload along with their validation errors, one page at a time.",
+    parameters=[
+        OpenApiParameter(name='upload_id', description='ID of the upload returned by the upload endpoint', required=True, type=int, location=OpenApiParameter.PATH),
+    ],
+    responses={
+        200: UploadErrorSerializer(many=True),
+        404: OpenApiResponse(description="Not Found - The specified upload_id does not exist."),
+    },
+    tags=['Leads']
+)
+@api_view(['GET'])
+def upload_errors(request, upload_id):
+    report = get_object_or_404(UploadReport, id=upload_id)
+    paginator = UploadErrorPagination()
+    page = paginator.paginate_queryset(report.errors.all(), request)
+    serializer = UploadErrorSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
 
-        serializer = LeadSerializer(data=row_data)
-        if serializer.is_valid():
-            serializer.save()
-            created_leads.append(serializer.data)
-        else:
-            # if only "name" is missing, fail; otherwise model handles defaults
-            failed_leads.append({"row": row, "errors": serializer.errors})
+'''
+Pseudo-buffer for csv.writer, so each row is handed straight to the StreamingHttpResponse instead of being collected in memory.
+'''
+class Echo:
+    def write(self, value):
+        return value
 
-    return Response({
-        'message': f'{len(created_leads)} leads uploaded successfully to offer: {offer_id}',
-        'failed': f'Failed to upload {len(failed_leads)} leads',
-        'created_leads': created_leads,
-        'failed_leads': failed_leads})
+'''
+Endpoint to download the failed rows of an upload as CSV. The rows are streamed from the database, so the error report is never built in memory.
+'''
+@extend_schema(
+    summary="Export upload errors as CSV",
+    description="Streams the failed rows of a lead upload as a CSV file, with the original columns and the validation errors.",
+    parameters=[
+        OpenApiParameter(name='upload_id', description='ID of the upload returned by the upload endpoint', required=True, type=int, location=OpenApiParameter.PATH),
+    ],
+    responses={
+        (200, 'text/csv'): OpenApiResponse(description="CSV file of the failed rows."),
+        404: OpenApiResponse(description="Not Found - The specified upload_id does not exist."),
+    },
+    tags=['Leads']
+)
+@api_view(['GET'])
+def export_upload_errors(request, upload_id):
+    report = get_object_or_404(UploadReport, id=upload_id)
+    fieldnames = report.fieldnames
 
+    def rows():
+        writer = csv.writer(Echo())
+        yield writer.writerow(['row_number', *fieldnames, 'errors'])
+        for error in report.errors.iterator(chunk_size=UPLOAD_BATCH_SIZE):
+            yield writer.writerow([error.row_number, *(error.row.get(field, '') for field in fieldnames), json.dumps(error.errors)])
+
+    return StreamingHttpResponse(
+        rows(),
+        content_type='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="upload_{upload_id}_errors.csv"'},
+    )
 
 
 @extend_schema(
@@ -120,7 +280,9 @@ def upload_leads(request, offer_id):
     request=None,
     responses={
         200: OpenApiResponse(description="Scoring completed successfully."),
+        400: OpenApiResponse(description="Bad Request - No leads left to score, or the remaining leads failed too many times."),
         404: OpenApiResponse(description="Not Found - The specified offer_id does not exist."),
+        409: OpenApiResponse(description="Conflict - The remaining leads are being scored by workers or waiting to retry."),
         500: OpenApiResponse(description="Internal Server Error during scoring process."),
     },
     tags=['Offers']
@@ -128,33 +290,54 @@ def upload_leads(request, offer_id):
 @api_view(['POST'])
 def get_leads_score(request, offer_id):
     offer = get_object_or_404(Offer, id=offer_id)
+    # The request claims the leads through a lease like a score_worker does, so the two never score the same lead.
+    owner = new_lease_owner('web')
     try:
-        # In case all the leads are scored for the given offer, the function stops.
-        leads_to_score = offer.leads.filter(score__isnull=True, intent_label__isnull=True, reasoning__isnull=True)
-        if not leads_to_score.exists():
-            return Response({'message': 'No leads left to score on this offer'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        for lead in leads_to_score:
-            
-            # for each lead we find the rule layer point out of 50 and the AI layer point out of 50. The AI layer also returns the AI verdict on the Intent and the reasoning for the verdict. 
-            rule_layer_points = get_rule_points(lead)
-            ai_layer_response = get_ai_response(lead)
-            
-            if 'error' in ai_layer_response:
-                return Response(ai_layer_response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            
-            # The calculated score out of 100, is saved to the corresponding object, along with the intent and reasoning.
-            final_score = rule_layer_points + ai_layer_response['AI_score']
-            lead.score = final_score
-            lead.intent_label = ai_layer_response['Intent']
-            lead.reasoning = ai_layer_response['Reason']
-            lead.save()
-            
+        # In case there is nothing to claim, the function stops and tells whether the leads are all scored, held by workers or out of attempts.
+        if not get_unleased_leads().filter(offer=offer).exists():
+            return no_leads_to_score_response(offer)
+
+        while leads_to_score := claim_leads(owner, SCORE_BATCH_SIZE, settings.SCORE_LEASE_SECONDS, offer_id=offer.id):
+            for lead in leads_to_score:
+                # for each lead we find the rule layer point out of 50 and the AI layer point out of 50. The AI layer also returns the AI verdict on the Intent and the reasoning for the verdict.
+                # The calculated score out of 100, is saved to the corresponding object, along with the intent and reasoning.
+                try:
+                    score_leased_lead(lead, owner, settings.SCORE_LEASE_SECONDS)
+                except DatabaseError:
+                    # Database errors are not the lead's fault, so they do not count as a scoring attempt.
+                    raise
+                except Exception as e:
+                    record_scoring_failure(lead, owner, e, settings.SCORE_LEASE_SECONDS)
+                    logger.exception('Scoring failed for lead %s', lead.id)
+                    raise
+
         return Response({'message': f'Scoring completed on the offer with id: {offer_id}'}, status=status.HTTP_200_OK)
 
     except Exception as e:
         return Response({'error': f'An unexpected error occurred: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    finally:
+        # Leads left in an unfinished batch are handed back right away instead of waiting for the lease to expire.
+        release_leases(owner)
+
+'''
+Builds the response of the score endpoint when no lead can be claimed, telling apart an offer whose leads are all scored, one whose leads are held by workers (or waiting to retry after a failure) and one whose leads ran out of attempts.
+'''
+def no_leads_to_score_response(offer):
+    pending_leads = offer.leads.filter(score__isnull=True, intent_label__isnull=True, reasoning__isnull=True)
+    failed = pending_leads.filter(score_attempts__gte=settings.SCORE_MAX_ATTEMPTS).count()
+    held = pending_leads.filter(score_attempts__lt=settings.SCORE_MAX_ATTEMPTS, lease_expires_at__gt=timezone.now()).count()
+    if not failed and not held:
+        return Response({'message': 'No leads left to score on this offer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    messages = []
+    if held:
+        messages.append(f'{held} leads are being scored by workers or waiting to retry')
+    if failed:
+        messages.append(f'{failed} leads failed {settings.SCORE_MAX_ATTEMPTS} times, run score_worker --retry-failed to retry them')
+    return Response({'message': '; '.join(messages), 'held': held, 'failed': failed},
+                    status=status.HTTP_409_CONFLICT if held else status.HTTP_400_BAD_REQUEST)
+
 
 '''
 Endpoint to fetch the result of scored leads from the database.
@@ -232,6 +415,45 @@ def export_result(request):
     writer.writeheader()
     writer.writerows(leads_data)
     return response
-    
 
-    
\ No newline at end of file
+
+'''
+Endpoint to list the requests captured by the profiling middleware. Only available to admin users.
+'''
+@extend_schema(
+    summary="View Request Profiles",
+    description="Retrieves the requests profiled with the X-Profile header or ?profile query parameter, along with their duration and SQL query stats. Admin only.",
+    responses=RequestProfileSerializer(many=True),
+    tags=['Profiling']
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def view_profiles(request):
+    all_profiles = RequestProfile.objects.all()
+    serializer = RequestProfileSerializer(all_profiles, many=True)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+'''
+Endpoint to download the cProfile stats of a profiled request as a .prof file. The file can be opened with pstats, snakeviz or flameprof.
+'''
+@extend_schema(
+    summary="Download profile stats",
+    description="Downloads the cProfile stats (pstats format) of a profiled request. Admin only.",
+    parameters=[
+        OpenApiParameter(name='profile_id', description='ID of the request profile', required=True, type=int, location=OpenApiParameter.PATH),
+    ],
+    responses={
+        (200, 'application/octet-stream'): OpenApiResponse(description="pstats file of the profiled request."),
+        404: OpenApiResponse(description="Not Found - The specified profile_id or its stats file does not exist."),
+    },
+    tags=['Profiling']
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def download_profile(request, profile_id):
+    profile = get_object_or_404(RequestProfile, id=profile_id)
+    stats_path = settings.PROFILING_DIR / profile.stats_file
+    if not stats_path.is_file():
+        raise Http404('Stats file not found')
+    return FileResponse(open(stats_path, 'rb'), as_attachment=True, filename=profile.stats_file)
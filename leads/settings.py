@@ -43,8 +43,20 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ProfilingMiddleware',
 ]
 
+# Opt-in request profiling. When enabled, requests from staff users sent with the X-Profile header or ?profile
+# query parameter are profiled and their stats are saved to PROFILING_DIR. Only the newest PROFILING_MAX_PROFILES are kept.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '100'))
+
+# Lead scoring leases, used by the score endpoint and the score_worker command. A lead that fails to score
+# SCORE_MAX_ATTEMPTS times is no longer picked up.
+SCORE_LEASE_SECONDS = 300
+SCORE_MAX_ATTEMPTS = 3
+
 ROOT_URLCONF = 'leads.urls'
 
 TEMPLATES = [